@@ -0,0 +1,101 @@
+"""
+Headless batch mode: preprocess the data and cluster it for every combination of parameters.
+
+Example:
+    python batch.py --states PR SC --years 2018 2019 --methods complete ward --thresholds 10 20 30
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import download as dl
+import clustering as cl
+import diagnostics
+import neighbors
+import runs
+import util
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Preprocess SIM data and apply hierarchical clustering without the web app.")
+    parser.add_argument('--states', nargs='+', default=util.available_states, choices=util.available_states,
+                        help="States to select (default: all available).")
+    parser.add_argument('--years', nargs='+', type=int, default=util.available_years, choices=util.available_years,
+                        help="Years to select (default: all available).")
+    parser.add_argument('--features', nargs='+', default=cl.default_features,
+                        help="Features used for clustering (default: same as the web app).")
+    parser.add_argument('--methods', nargs='+', default=['complete'], choices=cl.available_methods,
+                        help="Linkage methods (default: complete).")
+    parser.add_argument('--thresholds', nargs='+', type=float, required=True,
+                        help="Distance thresholds to evaluate and label the data with.")
+    parser.add_argument('--session', default='batch',
+                        help="Run store session to save the runs in (default: batch, listed by the web app).")
+    parser.add_argument('--jobs', type=int, default=None,
+                        help="Number of worker processes (default: one per method, up to the number of CPUs).")
+    parser.add_argument('--log', default=None,
+                        help="File to write the diagnostics log (JSON lines) to, '-' for stderr.")
+    return parser.parse_args(argv)
+
+def select_data(states: list, years: list, features: list):
+    """
+    Get preprocessed data (downloading and preprocessing it if needed) with the features, states and years.
+    Return all records: missing data is imputed over the whole dataset, as in the web app.
+    """
+    # Preprocess all states and years: the cached .csv files are shared with the web app
+    dl.get_CNES()
+    dl.get_municipality()
+    df_SIM = dl.get_SIM()
+    missing = [feature for feature in features if feature not in df_SIM.columns]
+    if missing:
+        raise ValueError(f"batch.select_data: features not found in preprocessed data: {', '.join(missing)}\n")
+    return df_SIM[list(dict.fromkeys(features + ['state', 'year']))]
+
+def cluster_method(df, method: str, thresholds: list, params: dict, session: str) -> list:
+    """
+    Apply one linkage method to the selected states and years, evaluate it and label the data for each threshold.
+    Save one run per threshold.
+    """
+    # Same encoding and linkage as the Cluster Analysis page, so batch and web runs are comparable
+    encoded = cl.EncodedFeatures(df[params['features']])
+    incremental_linkage = cl.IncrementalLinkage(df, params['features'], encoded)
+    (onehot_data, linkage_matrix) = incremental_linkage.linkage(params['states'], params['years'], method)
+    feature_columns = encoded.feature_columns(params['features'])
+    fill_values = encoded.fill_values(params['features'])
+    (results, _) = cl.evaluate_clustering(onehot_data, linkage_matrix, thresholds)
+    # The indexed rows are the same for every threshold, only the labels change
+    index = neighbors.NeighborIndex.from_labeled(onehot_data)
+    run_ids = []
+    for dist in thresholds:
+        labeled_data = cl.apply_labels(onehot_data.copy(), linkage_matrix, dist)
+        metrics = results.loc[results['Parameter'] == dist]
+        run_params = {**params, 'method': method, 'threshold': dist, 'feature_columns': feature_columns,
+                      'fill_values': fill_values}
+        profile = cl.cluster_profiles(labeled_data, feature_columns)
+        run_ids.append(runs.save_run(labeled_data, linkage_matrix, run_params, metrics, profile,
+                                     index.with_labels(labeled_data['cluster']), session=session))
+    return run_ids
+
+def main(argv: list = None) -> None:
+    args = parse_args(argv)
+    if args.log:
+        diagnostics.configure_logging(args.log)
+    df_SIM = select_data(args.states, args.years, args.features)
+    selected = df_SIM['state'].isin(args.states) & df_SIM['year'].isin(args.years)
+    print(f"batch: {selected.sum()} records selected.")
+    params = {'states': args.states, 'years': args.years, 'features': args.features}
+    jobs = args.jobs or min(len(args.methods), os.cpu_count())
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(cluster_method, df_SIM, method, args.thresholds, params, args.session): method
+                   for method in args.methods}
+        failed = []
+        for future in as_completed(futures):
+            try:
+                print(f"batch: {futures[future]} linkage done, runs saved: {', '.join(future.result())}")
+            except Exception as e:
+                print(f"batch: {futures[future]} linkage failed: {e}")
+                failed.append(futures[future])
+    if failed:
+        raise SystemExit(f"batch: failed methods: {', '.join(failed)}")
+
+if __name__ == '__main__':
+    main()
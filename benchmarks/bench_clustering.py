@@ -0,0 +1,71 @@
+"""
+Benchmarks for hierarchical clustering, evaluation and labeling.
+"""
+
+import numpy as np
+import pytest
+from scipy.cluster.hierarchy import linkage, cophenet
+from scipy.spatial.distance import pdist
+
+import clustering as cl
+
+# pdist and silhouette scores need memory quadratic in the number of records
+MAX_RECORDS = 5000
+ROUNDS = 3
+
+@pytest.fixture(scope="module")
+def selected(preprocessed):
+    return preprocessed[cl.default_features]
+
+@pytest.fixture(scope="module")
+def linked(selected):
+    return cl.apply_linkage(selected.copy(), 'complete')
+
+def thresholds(linkage_matrix, count: int) -> list:
+    """
+    Distance thresholds evenly spread over the upper half of the dendrogram.
+    """
+    heights = linkage_matrix[:, 2]
+    return list(np.linspace(np.median(heights), heights.max(), count + 2)[1:-1])
+
+@pytest.mark.parametrize("method", cl.available_methods)
+def bench_apply_linkage(benchmark, selected, method):
+    benchmark.pedantic(cl.apply_linkage, setup=lambda: ((selected.copy(), method), {}), rounds=ROUNDS)
+
+@pytest.mark.parametrize("n_thresholds", [1, 5, 10])
+def bench_evaluate_clustering(benchmark, linked, n_thresholds):
+    (onehot_data, linkage_matrix) = linked
+    dist_values = thresholds(linkage_matrix, n_thresholds)
+    benchmark.pedantic(cl.evaluate_clustering, args=(onehot_data, linkage_matrix, dist_values), rounds=ROUNDS)
+
+def bench_apply_labels(benchmark, linked):
+    (onehot_data, linkage_matrix) = linked
+    dist = thresholds(linkage_matrix, 1)[0]
+    benchmark.pedantic(cl.apply_labels, setup=lambda: ((onehot_data.copy(), linkage_matrix, dist), {}), rounds=ROUNDS)
+
+@pytest.mark.parametrize("method", ['single', 'complete'])
+def bench_incremental_linkage(benchmark, preprocessed, method):
+    # Add the last year to a selection that was already clustered
+    states = sorted(preprocessed['state'].unique())
+    years = sorted(preprocessed['year'].unique())
+
+    def setup():
+        incremental = cl.IncrementalLinkage(preprocessed, cl.default_features)
+        incremental.linkage(states, years[:-1], method)
+        return ((incremental,), {})
+    (onehot_data, linkage_matrix) = benchmark.pedantic(lambda incremental: incremental.linkage(states, years, method),
+                                                       setup=setup, rounds=ROUNDS)
+    # Same tree as clustering the selection from scratch (merge order may differ between equal distances)
+    scratch = linkage(pdist(onehot_data.values), method=method)
+    assert np.allclose(np.sort(linkage_matrix[:, 2]), np.sort(scratch[:, 2]))
+    assert np.allclose(cophenet(linkage_matrix), cophenet(scratch))
+
+def bench_encode_features(benchmark, selected):
+    benchmark.pedantic(lambda df: cl.EncodedFeatures(df).select(cl.default_features), setup=lambda: ((selected.copy(),), {}), rounds=ROUNDS)
+
+def bench_select_encoded_features(benchmark, preprocessed):
+    # Feature subset and row selection from an already encoded dataset
+    encoded = cl.EncodedFeatures(preprocessed)
+    encoded.feature_columns(cl.default_features)
+    rows = preprocessed['state'].isin(['PR', 'SC']).to_numpy()
+    benchmark.pedantic(encoded.select, args=(cl.default_features[:6], rows), rounds=ROUNDS)
@@ -0,0 +1,78 @@
+"""
+Benchmarks for the figure functions.
+"""
+
+import pytest
+
+import clustering as cl
+import figures
+import synthetic
+
+# Silhouette plots and dendrograms are quadratic in the number of records
+MAX_RECORDS = 5000
+ROUNDS = 3
+
+features = ['IDADE', 'SEXO', 'ESC', 'method', 'season', 'facility_rate']
+map_states = ['PR', 'SC', 'RS']
+
+@pytest.fixture(scope="module")
+def linked(preprocessed):
+    return cl.apply_linkage(preprocessed[features].copy(), 'ward')
+
+@pytest.fixture(scope="module")
+def labels(linked):
+    (onehot_data, linkage_matrix) = linked
+    return cl.fcluster(linkage_matrix, t=8, criterion='maxclust')
+
+@pytest.fixture(scope="module")
+def labeled(linked, labels):
+    df = linked[0].copy()
+    df['cluster'] = labels
+    return df
+
+@pytest.fixture(scope="module")
+def profile(linked, labeled):
+    return cl.cluster_profiles(labeled, linked[0].attrs['feature_columns'])
+
+def bench_plot_dendrogram(benchmark, linked):
+    benchmark.pedantic(figures.plot_dendrogram, args=(linked[1], 4), rounds=ROUNDS)
+
+def bench_plot_silhouette(benchmark, linked, labels):
+    benchmark.pedantic(figures.plot_silhouette, args=(linked[0].values, labels), rounds=ROUNDS)
+
+def bench_two_feature_barplot(benchmark, preprocessed):
+    benchmark.pedantic(figures.two_feature_barplot, args=(preprocessed, 'method', 'year', True), rounds=ROUNDS)
+
+def bench_cluster_profiles(benchmark, linked, labeled):
+    benchmark.pedantic(cl.cluster_profiles, args=(labeled, linked[0].attrs['feature_columns']), rounds=ROUNDS)
+
+def bench_feature_cluster_heatmap(benchmark, profile):
+    benchmark.pedantic(figures.feature_cluster_heatmap, args=(profile, 'ESC'), rounds=ROUNDS)
+
+@pytest.fixture
+def geometry_cache(tmp_path, monkeypatch):
+    # Synthetic geometry in a temporary cache instead of downloading it with geobr
+    for state in map_states:
+        figures.write_geometry_cache(synthetic.municipality_geometry(state), str(tmp_path / f"{state}.parquet"))
+    monkeypatch.setattr(figures, 'geometry_dir', str(tmp_path))
+    monkeypatch.setattr(figures, '_geometry', {})
+
+@pytest.mark.parametrize("state", map_states)
+def bench_state_geomap(benchmark, preprocessed, state, geometry_cache):
+    benchmark.pedantic(figures.state_geomap, args=(preprocessed, state, 'average_suicide_rate'), rounds=1)
+
+def bench_state_geomaps_sequential(benchmark, preprocessed, geometry_cache):
+    values = figures.municipality_values(preprocessed, 'average_suicide_rate')
+    benchmark.pedantic(lambda: [figures._render_state_map(values, state, 'average_suicide_rate') for state in map_states],
+                       rounds=1)
+
+def bench_state_geomaps_concurrent(benchmark, preprocessed, geometry_cache, monkeypatch):
+    monkeypatch.setattr(figures, 'map_processes', len(map_states))
+    monkeypatch.setattr(figures, '_map_executor', None)
+    # The warmup round starts the worker processes, which are reused by later calls
+    benchmark.pedantic(figures.state_geomaps, args=(preprocessed, map_states, 'average_suicide_rate'),
+                       rounds=1, warmup_rounds=1)
+    figures.get_map_executor().shutdown()
+
+def bench_multi_state_geomap(benchmark, preprocessed, geometry_cache):
+    benchmark.pedantic(figures.multi_state_geomap, args=(preprocessed, map_states, 'average_suicide_rate'), rounds=1)
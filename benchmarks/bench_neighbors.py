@@ -0,0 +1,42 @@
+"""
+Benchmarks for the nearest-neighbor index against brute-force search.
+"""
+
+import numpy as np
+import pytest
+
+import clustering as cl
+import neighbors
+import synthetic
+
+ROUNDS = 3
+N_QUERIES = 1000
+
+@pytest.fixture(scope="module")
+def labeled(preprocessed):
+    # Cluster labels don't change the cost of queries, so they are drawn at random instead of running the linkage
+    df = cl.EncodedFeatures(preprocessed).select(cl.default_features)
+    df['cluster'] = np.random.default_rng(0).integers(1, 50, len(df))
+    return df
+
+@pytest.fixture(scope="module")
+def indexes(labeled):
+    return {backend: neighbors.NeighborIndex.from_labeled(labeled, backend=backend)
+            for backend in neighbors.available_backends}
+
+@pytest.fixture(scope="module")
+def new_records(indexes):
+    return indexes['brute'].encode(synthetic.preprocessed_SIM(N_QUERIES, seed=1), cl.default_features)
+
+@pytest.mark.parametrize("backend", neighbors.available_backends)
+def bench_build_index(benchmark, labeled, backend):
+    benchmark.pedantic(neighbors.NeighborIndex.from_labeled, args=(labeled,), kwargs={'backend': backend}, rounds=ROUNDS)
+
+@pytest.mark.parametrize("k", [1, 10])
+@pytest.mark.parametrize("backend", neighbors.available_backends)
+def bench_query(benchmark, indexes, new_records, backend, k):
+    benchmark.pedantic(indexes[backend].query, args=(new_records, k), rounds=ROUNDS)
+
+@pytest.mark.parametrize("backend", neighbors.available_backends)
+def bench_assign(benchmark, indexes, new_records, backend):
+    benchmark.pedantic(indexes[backend].assign, args=(new_records, 5), rounds=ROUNDS)
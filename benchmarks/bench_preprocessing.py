@@ -0,0 +1,86 @@
+"""
+Benchmarks for each preprocessing stage of the data pipeline.
+"""
+
+import os
+
+import pandas as pd
+import pytest
+
+import download as dl
+import synthetic
+
+ROUNDS = 3
+
+@pytest.fixture(scope="module")
+def raw(n_records):
+    return synthetic.raw_SIM(n_records)
+
+@pytest.fixture(scope="module")
+def stripped(raw):
+    return dl.strip_SIM(raw)
+
+@pytest.fixture(scope="module")
+def suicides(n_records):
+    # Every record is a suicide, so all the following stages process n_records
+    return dl.filter_suicides(dl.strip_SIM(synthetic.raw_SIM(n_records, suicide_share=1.0)))
+
+@pytest.fixture(scope="module")
+def decoded(suicides):
+    return dl.decode_SIM(suicides.copy())
+
+@pytest.fixture(scope="module")
+def extracted(decoded):
+    return dl.extract_features(decoded.copy())
+
+@pytest.fixture(scope="module")
+def municipality():
+    return synthetic.municipality_data()
+
+def copy_of(df):
+    return lambda: ((df.copy(),), {})
+
+def bench_read_raw(benchmark, raw, tmp_path):
+    path = tmp_path / "SIM.parquet"
+    raw.to_parquet(path)
+    benchmark.pedantic(pd.read_parquet, args=(path,), rounds=ROUNDS)
+
+def bench_strip(benchmark, raw):
+    benchmark.pedantic(dl.strip_SIM, args=(raw,), rounds=ROUNDS)
+
+def bench_filter_suicides(benchmark, stripped):
+    benchmark.pedantic(dl.filter_suicides, setup=copy_of(stripped), rounds=ROUNDS)
+
+def bench_decode(benchmark, suicides):
+    benchmark.pedantic(dl.decode_SIM, setup=copy_of(suicides), rounds=ROUNDS)
+
+def bench_extract_features(benchmark, decoded):
+    benchmark.pedantic(dl.extract_features, setup=copy_of(decoded), rounds=ROUNDS)
+
+def bench_merge_municipality(benchmark, extracted, municipality):
+    benchmark.pedantic(lambda df: dl.merge_municipality(df, municipality), setup=copy_of(extracted), rounds=ROUNDS)
+
+def bench_write(benchmark, extracted, tmp_path):
+    benchmark.pedantic(extracted.to_csv, args=(tmp_path / "preprocessed_SIM.csv",), kwargs={'index': False}, rounds=ROUNDS)
+
+def bench_get_CNES(benchmark, n_records, tmp_path, monkeypatch):
+    os.makedirs(tmp_path / "data" / "rawdata")
+    synthetic.raw_CNES(n_records).to_parquet(tmp_path / "data" / "rawdata" / "CNES.parquet")
+    monkeypatch.chdir(tmp_path)
+
+    def remove_cache():
+        if os.path.exists("./data/preprocessed_CNES.csv"):
+            os.remove("./data/preprocessed_CNES.csv")
+    benchmark.pedantic(dl.get_CNES, setup=remove_cache, rounds=ROUNDS)
+
+def bench_get_municipality(benchmark, n_records, tmp_path, monkeypatch):
+    os.makedirs(tmp_path / "data" / "rawdata")
+    synthetic.raw_municipality().to_csv(tmp_path / "data" / "rawdata" / "municipality_raw.csv", index=False)
+    synthetic.raw_CNES(n_records).to_parquet(tmp_path / "data" / "rawdata" / "CNES.parquet")
+    monkeypatch.chdir(tmp_path)
+    dl.get_CNES()
+
+    def remove_cache():
+        if os.path.exists("./data/municipality_data.csv"):
+            os.remove("./data/municipality_data.csv")
+    benchmark.pedantic(dl.get_municipality, setup=remove_cache, rounds=ROUNDS)
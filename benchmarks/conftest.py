@@ -0,0 +1,43 @@
+"""
+Benchmark configuration: dataset scales and synthetic data fixtures.
+"""
+
+import os
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import pytest
+
+import synthetic
+
+# The repository root is the working directory of the data functions ('./data/...')
+os.chdir(os.path.join(os.path.dirname(__file__), '..'))
+
+def pytest_addoption(parser):
+    parser.addoption("--scales", default="1000,10000",
+                     help="Comma-separated numbers of synthetic records (1000 up to 1000000).")
+
+def pytest_generate_tests(metafunc):
+    """
+    Parametrize 'n_records' with the selected scales, skipping those above the module's MAX_RECORDS.
+    """
+    if "n_records" in metafunc.fixturenames:
+        scales = [int(scale) for scale in metafunc.config.getoption("scales").split(",")]
+        max_records = getattr(metafunc.module, "MAX_RECORDS", None)
+        params = []
+        for scale in scales:
+            marks = []
+            if max_records is not None and scale > max_records:
+                marks = pytest.mark.skip(reason=f"{metafunc.module.__name__} runs up to {max_records} records")
+            params.append(pytest.param(scale, marks=marks, id=str(scale)))
+        metafunc.parametrize("n_records", params, scope="module")
+
+@pytest.fixture(scope="module")
+def preprocessed(n_records):
+    return synthetic.preprocessed_SIM(n_records)
+
+@pytest.fixture(autouse=True)
+def close_figures():
+    yield
+    plt.close('all')
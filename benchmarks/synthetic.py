@@ -0,0 +1,181 @@
+"""
+Synthetic SIM, CNES and IBGE data generator for benchmarks.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyarrow.parquet as pq
+from shapely.geometry import box
+
+import util
+
+# Width of the raw (DBF converted) SIM attributes, values are left-justified and padded with spaces
+SIM_widths = {'DTOBITO': 8, 'HORAOBITO': 9, 'CAUSABAS': 8, 'LOCOCOR': 7, 'CODMUNRES': 6,
+              'IDADE': 5, 'SEXO': 4, 'RACACOR': 7, 'ESC': 3, 'ESTCIV': 6}
+# Most frequent causes of death other than suicide
+other_causes = ['I219', 'I64', 'J189', 'J449', 'C349', 'J440', 'E149', 'I10', 'R99', 'V892']
+age_groups = ['(10, 20]', '(20, 30]', '(30, 40]', '(40, 50]', '(50, 60]',
+              '(60, 70]', '(70, 80]', '(80, 90]', '(90, 100]']
+seasons = ['Summer', 'Autumn', 'Winter', 'Spring']
+weekdays = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+day_periods = ['Night', 'Morning', 'Afternoon', 'Evening']
+
+def raw_columns(database: str) -> list:
+    """
+    Get the column layout of the cached raw parquet files, if there are any.
+    """
+    data_dir = f'./data/rawdata/{database}'
+    if not os.path.isdir(data_dir):
+        return []
+    for root, _, files in os.walk(data_dir):
+        for file in sorted(files):
+            if file.endswith('.parquet'):
+                return pq.read_schema(os.path.join(root, file)).names
+    return []
+
+def municipality_data(states: list = util.available_states, seed: int = 0) -> pd.DataFrame:
+    """
+    Municipality data as returned by download.get_municipality (cached file or synthetic).
+    """
+    state_codes = [code for code, state in util.dict_states.items() if state in states]
+    try:
+        df_muni = pd.read_csv('./data/municipality_data.csv')
+        return df_muni.loc[df_muni['CODMUN'].astype(str).str[:2].isin(state_codes)].reset_index(drop=True)
+    except FileNotFoundError:
+        rng = np.random.default_rng(seed)
+        codes = [int(code) * 10000 + i for code in state_codes for i in range(1, 300)]
+        df_muni = pd.DataFrame({'CODMUN': codes, 'name_muni': [f"Municipio {code}" for code in codes]})
+        df_muni['pop_muni'] = rng.lognormal(9.5, 1.2, len(codes)).astype(int) + 800
+        df_muni['num_facilities'] = rng.poisson(1.5, len(codes)).astype(float)
+        df_muni['facility_rate'] = df_muni['num_facilities'] / df_muni['pop_muni'] * 1000
+        return df_muni
+
+def raw_SIM(n_records: int, states: list = util.available_states, years: list = util.available_years,
+            suicide_share: float = 0.01, seed: int = 0) -> pd.DataFrame:
+    """
+    Generate raw SIM records with the layout of the parquet files downloaded by PySUS.
+    """
+    rng = np.random.default_rng(seed)
+    codmun = municipality_data(states)['CODMUN'].astype(str).to_numpy()
+    dates = pd.to_datetime([f"{year}-01-01" for year in years]).to_numpy()
+    dates = rng.choice(dates, n_records) + rng.integers(0, 365, n_records).astype('timedelta64[D]')
+    suicide = rng.random(n_records) < suicide_share
+    causes = np.where(suicide,
+                      rng.choice(list(util.dict_methods.keys()), n_records),
+                      rng.choice(other_causes, n_records))
+    hours = np.char.add(np.char.zfill(rng.integers(0, 24, n_records).astype(str), 2),
+                        rng.choice(['00', '15', '30', '45'], n_records))
+    columns = {
+        'DTOBITO': pd.DatetimeIndex(dates).strftime('%d%m%Y').to_numpy(),
+        'HORAOBITO': np.where(rng.random(n_records) < 0.02, '', hours),
+        'CAUSABAS': np.char.add(causes, rng.integers(0, 10, n_records).astype(str)),
+        'LOCOCOR': rng.choice(['1', '2', '3', '4', '5', '9'], n_records, p=[.63, .05, .23, .06, .025, .005]),
+        'CODMUNRES': rng.choice(codmun, n_records),
+        'IDADE': np.char.add('4', np.char.zfill(rng.integers(10, 100, n_records).astype(str), 2)),
+        'SEXO': rng.choice(['1', '2', '9'], n_records, p=[.585, .41, .005]),
+        'RACACOR': rng.choice(['1', '2', '3', '4', '5', ''], n_records, p=[.81, .035, .008, .11, .002, .035]),
+        'ESC': rng.choice(['1', '2', '3', '4', '5', '9'], n_records, p=[.17, .3, .25, .115, .05, .115]),
+        'ESTCIV': rng.choice(['1', '2', '3', '4', '5', '9', ''], n_records, p=[.22, .4, .26, .055, .015, .015, .035])
+    }
+    df_SIM = pd.DataFrame({col: np.char.ljust(values.astype(str), SIM_widths[col]) for col, values in columns.items()})
+    # Fill the remaining raw attributes with blanks
+    for col in raw_columns('SIM'):
+        if col not in df_SIM:
+            df_SIM[col] = ''
+    return df_SIM
+
+def raw_CNES(n_records: int, states: list = util.available_states, years: list = util.available_years,
+             seed: int = 0) -> pd.DataFrame:
+    """
+    Generate raw CNES (group ST) records with the layout of the parquet files downloaded by PySUS.
+    """
+    rng = np.random.default_rng(seed)
+    codmun = municipality_data(states)['CODMUN'].astype(str).to_numpy()
+    df_CNES = pd.DataFrame({
+        'CNES': np.char.zfill(rng.integers(0, 10**7, n_records).astype(str), 7),
+        'COMPETEN': np.char.add(rng.choice(years, n_records).astype(str), '01'),
+        'CODUFMUN': rng.choice(codmun, n_records),
+        'COD_CEP': np.char.zfill(rng.integers(8 * 10**7, 10**8, n_records).astype(str), 8),
+        'NATUREZA': rng.choice(['01', '03', '07', '08', '11', '13'], n_records, p=[.18, .01, .77, .01, .02, .01]),
+        'VINC_SUS': rng.choice(['0', '1'], n_records),
+        'TP_UNID': rng.choice(['01', '02', '22', '36', '39'], n_records, p=[.06, .09, .63, .14, .08]),
+        'SERAP02P': rng.choice(['0', '1'], n_records, p=[.95, .05]),
+        'SERAP02T': rng.choice(['0', '1'], n_records, p=[.97, .03])
+    })
+    for col in raw_columns('CNES'):
+        if col not in df_CNES:
+            df_CNES[col] = ''
+    return df_CNES
+
+def preprocessed_SIM(n_records: int, states: list = util.available_states, years: list = util.available_years,
+                     seed: int = 0) -> pd.DataFrame:
+    """
+    Generate records with the schema of the preprocessed SIM data (as read from the cached .csv).
+    """
+    rng = np.random.default_rng(seed)
+    df_muni = municipality_data(states).sample(n_records, replace=True, random_state=seed).reset_index(drop=True)
+    dates = pd.to_datetime([f"{year}-01-01" for year in years]).to_numpy()
+    dates = pd.DatetimeIndex(rng.choice(dates, n_records) + rng.integers(0, 365, n_records).astype('timedelta64[D]'))
+    causes = rng.choice(list(util.dict_methods.keys()), n_records)
+    age = rng.integers(11, 100, n_records)
+
+    def with_nulls(values, share):
+        return np.where(rng.random(n_records) < share, None, values)
+
+    df_SIM = pd.DataFrame({
+        'DTOBITO': dates.strftime('%Y-%m-%d'),
+        'HORAOBITO': rng.integers(0, 2400, n_records),
+        'CAUSABAS': causes,
+        'LOCOCOR': with_nulls(rng.choice(["Estabelecimento de saude", "Domicilio", "Via publica", "Outro"], n_records), 0.01),
+        'CODMUN': df_muni['CODMUN'],
+        'IDADE': age,
+        'SEXO': with_nulls(rng.choice(["Masculino", "Feminino"], n_records, p=[.79, .21]), 0.005),
+        'RACACOR': with_nulls(rng.choice(["Branca", "Preta", "Amarela", "Parda", "Indigena"], n_records), 0.03),
+        'ESC': with_nulls(rng.choice(["Sem escolaridade", "Fundamental I", "Fundamental II", "Médio", "Superior"], n_records), 0.15),
+        'ESTCIV': with_nulls(rng.choice(["Solteiro", "Casado", "Viuvo", "Divorciado", "Uniao estavel"], n_records), 0.05),
+        'year': dates.year,
+        'month': dates.month,
+        'day': dates.day,
+        'season': rng.choice(seasons, n_records),
+        'weekday': np.array(weekdays)[dates.weekday],
+        'holiday': rng.random(n_records) < 0.04,
+        'state': df_muni['CODMUN'].apply(util.get_state),
+        'name_muni': df_muni['name_muni'],
+        'pop_muni': df_muni['pop_muni'],
+        'facility_rate': df_muni['facility_rate'],
+        'average_suicide_rate': rng.gamma(2.0, 5.0, n_records),
+        'age_group': np.array(age_groups)[np.minimum((age - 11) // 10, len(age_groups) - 1)],
+        'method': [util.dict_methods[cause] for cause in causes],
+        'day_period': with_nulls(rng.choice(day_periods, n_records), 0.1)
+    })
+    return df_SIM
+
+def municipality_geometry(state: str) -> gpd.GeoDataFrame:
+    """
+    Grid of square municipalities with the layout returned by geobr.read_municipality.
+    """
+    state_code = [code for code, abbrev in util.dict_states.items() if abbrev == state][0]
+    df_muni = municipality_data([state])
+    side = int(np.ceil(np.sqrt(len(df_muni))))
+    geometry = [box(i % side, i // side, i % side + 1, i // side + 1) for i in range(len(df_muni))]
+    return gpd.GeoDataFrame({
+        'code_muni': df_muni['CODMUN'] * 10.0,
+        'name_muni': df_muni['name_muni'],
+        'code_state': float(state_code),
+        'abbrev_state': state
+    }, geometry=geometry)
+
+def raw_municipality(states: list = util.available_states) -> pd.DataFrame:
+    """
+    Municipality population table with the layout returned by IBGE.get_sidra_table (table 1505).
+    """
+    df_muni = municipality_data(states)
+    # Codes have 7 digits in IBGE tables (verification digit) and names include the state
+    return pd.DataFrame({
+        'D1C': df_muni['CODMUN'] * 10 + 1,
+        'D1N': df_muni['name_muni'] + ' - ' + df_muni['CODMUN'].apply(util.get_state),
+        'V': df_muni['pop_muni']
+    })
@@ -2,15 +2,25 @@
 Functions for cluster analysis.
 '''
 
+import threading
+from collections import OrderedDict
+
 import pandas as pd
 import numpy as np
 from scipy.cluster.hierarchy import linkage, fcluster
-from scipy.spatial.distance import pdist
+from scipy.spatial.distance import pdist, cdist
 from sklearn.metrics import silhouette_score, calinski_harabasz_score   
 
-from util import impute_df
+import diagnostics
+from util import impute_value
 from figures import plot_silhouette
+
+available_methods = ['single', 'complete', 'average', 'weighted', 'centroid', 'median', 'ward']
+default_features = ['IDADE', 'LOCOCOR', 'SEXO', 'RACACOR', 'ESC', 'ESTCIV', 'age_group', 'method', 'season', 'day_period', 'weekday', 'facility_rate']
+tile_cache_bytes = 2**30 # Distance tiles kept by each IncrementalLinkage (1 GB), least recently used are dropped
+results_kept = 8 # Linkage matrices kept by each IncrementalLinkage
     
+@diagnostics.traced('evaluate_clustering')
 def evaluate_clustering(df, linkage_matrix, dist_values, gen_plots=False) -> tuple:
     """
     Evaluate clustering results for a list of distance threshold values.
@@ -20,8 +30,12 @@ def evaluate_clustering(df, linkage_matrix, dist_values, gen_plots=False) -> tup
     for dist in dist_values:
         labels = fcluster(linkage_matrix, t=dist, criterion='distance')
         n_clusters = len(np.unique(labels))
-        sil = silhouette_score(df.values, labels)
-        ch = calinski_harabasz_score(df.values, labels)
+        # Scores are only defined for 2 to n_samples - 1 clusters
+        if 1 < n_clusters < len(df):
+            sil = silhouette_score(df.values, labels)
+            ch = calinski_harabasz_score(df.values, labels)
+        else:
+            sil, ch = np.nan, np.nan
         results.append((dist, n_clusters, sil, ch))
         #results.append(f"Parameter = {dist}: Silhouette score = {sil}; CH score = {ch}; Number of clusters = {n_clusters}")
         if gen_plots:
@@ -29,22 +43,320 @@ def evaluate_clustering(df, linkage_matrix, dist_values, gen_plots=False) -> tup
     results = pd.DataFrame(results, columns=['Parameter', 'Clusters (k)', 'Silhouette score', 'CH score'])
     return (results, plots)
 
+@diagnostics.traced('apply_linkage')
 def apply_linkage(df, selected_method='complete') -> tuple:
     """
     Apply clustering algorithm. Return one-hot encoded data and the linkage matrix.
+    The encoded columns of each feature are in df.attrs['feature_columns'].
     """
-    # Impute missing data
-    df = impute_df(df)
-    # Apply one-hot encoding to categorical features
-    categorical_features = df.select_dtypes(exclude=[np.number]).columns.tolist()
-    df = pd.get_dummies(df, columns=categorical_features, dtype=float)
+    encoded = EncodedFeatures(df)
+    df = encoded.select(df.columns)
+    df.attrs['feature_columns'] = encoded.feature_columns(encoded.features)
     # Get the linkage matrix
     dist_matrix = pdist(df)
     linkage_matrix = linkage(dist_matrix, method=selected_method)
     return (df, linkage_matrix)
 
 def apply_labels(df, linkage_matrix, dist: int) -> pd.DataFrame:
+    """
+    Add cluster labels for a distance threshold. Use runs.save_run to store the result.
+    """
     labels = fcluster(linkage_matrix, t=dist, criterion='distance')
     df['cluster'] = labels
-    df.to_csv('./data/labeled_data.csv', index=False)
-    return df
\ No newline at end of file
+    return df
+
+def cluster_profiles(df: pd.DataFrame, feature_columns: dict) -> pd.DataFrame:
+    """
+    Profile of every cluster over all encoded columns of labeled data, as a tidy table with
+    one row per cluster and column: number of rows in the cluster ('size'), rows with the category
+    ('count', one-hot columns only), mean (proportion for one-hot columns), population mean and lift.
+    """
+    column_feature = {column: feature for (feature, columns) in feature_columns.items()
+                      for column in columns if column in df.columns}
+    columns = list(column_feature)
+    # One grouped pass: sums of all columns per cluster
+    sums = df[columns].groupby(df['cluster']).sum()
+    sizes = df['cluster'].value_counts().reindex(sums.index)
+    means = sums.div(sizes, axis=0)
+    population_means = df[columns].mean()
+
+    profile = pd.DataFrame({
+        'cluster': np.repeat(sums.index.to_numpy(), len(columns)),
+        'feature': np.tile([column_feature[column] for column in columns], len(sums)),
+        'column': np.tile(columns, len(sums)),
+        'size': np.repeat(sizes.to_numpy(), len(columns)),
+        'count': sums.to_numpy().ravel(),
+        'mean': means.to_numpy().ravel(),
+        'population_mean': np.tile(population_means.to_numpy(), len(sums))
+    })
+    onehot = [len(feature_columns[feature]) > 1 or column != feature for (column, feature) in column_feature.items()]
+    profile.loc[~np.tile(onehot, len(sums)), 'count'] = np.nan
+    profile['lift'] = profile['mean'] / profile['population_mean'].replace(0, np.nan)
+    return profile
+
+class EncodedFeatures:
+    """
+    Imputed and encoded features of a dataset.
+
+    Each feature is encoded once, when first selected, into a contiguous block of columns
+    (numeric or one-hot encoded). Any subset of features and rows is then taken from the
+    blocks instead of encoding again.
+    Missing data is imputed over the whole dataset, or with given values (feature -> value), e.g.
+    the values imputed in another dataset (see fill_values).
+    """
+    def __init__(self, df: pd.DataFrame, fill_values: dict = None):
+        self.df = df
+        self.features = df.columns.tolist()
+        self.given_values = fill_values or {}
+        self.values = {} # feature -> imputed value (None if missing data is kept)
+        self.blocks = {} # feature -> encoded block (rows x columns, Fortran order)
+        self.columns = {} # feature -> encoded column names
+
+    def block(self, feature: str) -> np.ndarray:
+        if feature not in self.blocks:
+            column = self.df[feature]
+            value = self.given_values[feature] if feature in self.given_values else impute_value(column)
+            if value is not None:
+                column = column.fillna(value)
+            if np.issubdtype(column.dtype, np.number):
+                (block, columns) = (column.to_numpy(dtype=float).reshape(-1, 1), [feature])
+            else:
+                dummies = pd.get_dummies(column, prefix=feature, dtype=float)
+                (block, columns) = (np.asfortranarray(dummies.to_numpy()), dummies.columns.tolist())
+            # The instance may be shared by threads: a block is only published with its columns
+            self.values[feature] = value
+            self.columns[feature] = columns
+            self.blocks[feature] = block
+        return self.blocks[feature]
+
+    def fill_values(self, features: list) -> dict:
+        """
+        Value imputed for each feature (None if missing data is kept), as plain Python values.
+        """
+        values = {}
+        for feature in features:
+            self.block(feature)
+            value = self.values[feature]
+            values[feature] = value.item() if isinstance(value, np.generic) else value
+        return values
+
+    def feature_columns(self, features: list) -> dict:
+        """
+        Encoded column names of each feature.
+        """
+        for feature in features:
+            self.block(feature)
+        return {feature: self.columns[feature] for feature in features}
+
+    def select(self, features: list, rows=None) -> pd.DataFrame:
+        """
+        Encoded data for a list of features and a selection of rows (boolean mask or positions).
+        """
+        blocks = [self.block(feature) for feature in features]
+        columns = [column for feature in features for column in self.columns[feature]]
+        index = self.df.index
+        if rows is not None:
+            blocks = [block[rows] for block in blocks]
+            index = index[rows]
+        return pd.DataFrame(np.hstack(blocks), index=index, columns=columns)
+
+class IncrementalLinkage:
+    """
+    Hierarchical clustering over (state, year) partitions of the preprocessed data.
+
+    Encoded blocks and the distance tiles between them are kept, so a new selection only
+    computes the tiles it doesn't have yet. Tiles are kept up to tile_cache_bytes (least recently
+    used are dropped first), and the linkage matrices of the last calls are kept. Single linkage
+    keeps the minimum spanning tree of the last selection and, when partitions are added, merges
+    it with the new edges instead of starting over (without the distances within the old tree).
+    Missing data is imputed over the whole dataset (not the selection), so that blocks are
+    encoded the same way in every selection.
+    An instance can be shared by several threads (e.g. the sessions of the web app).
+    """
+    def __init__(self, df: pd.DataFrame, features: list, encoded: EncodedFeatures = None):
+        self.features = features
+        if encoded is None:
+            encoded = EncodedFeatures(df[features])
+        self.encoded = encoded.select(features)
+        self.partitions = {key: rows for key, rows in df.groupby(['state', 'year']).indices.items()}
+        self.blocks = {} # partition -> encoded rows
+        self.tiles = OrderedDict() # (partition, partition) -> distances (condensed within a partition), least recently used first
+        self.tile_bytes = 0
+        self.tiles_lock = threading.Lock()
+        self.mst = None # (partitions, edges as global row positions, weights) of the last single linkage
+        self.results = OrderedDict() # (partitions, method) -> linkage matrix of the last calls, least recent first
+
+    def selection(self, states: list, years: list) -> list:
+        """
+        Sorted partitions of a selection of states and years.
+        """
+        return sorted(key for key in self.partitions if key[0] in states and key[1] in years)
+
+    def block(self, key) -> np.ndarray:
+        if key not in self.blocks:
+            self.blocks[key] = self.encoded.values[self.partitions[key]]
+        return self.blocks[key]
+
+    def tile(self, key_a, key_b) -> np.ndarray:
+        """
+        Distances between two partitions (key_a <= key_b), computed only once while they are cached.
+        """
+        with self.tiles_lock:
+            if (key_a, key_b) in self.tiles:
+                self.tiles.move_to_end((key_a, key_b))
+                return self.tiles[(key_a, key_b)]
+        if key_a == key_b:
+            distances = pdist(self.block(key_a))
+        else:
+            distances = cdist(self.block(key_a), self.block(key_b))
+        with self.tiles_lock:
+            if (key_a, key_b) not in self.tiles:
+                self.tiles[(key_a, key_b)] = distances
+                self.tile_bytes += distances.nbytes
+            while self.tile_bytes > tile_cache_bytes:
+                self.tile_bytes -= self.tiles.popitem(last=False)[1].nbytes
+        return distances
+
+    def condensed_distances(self, keys: list, skip: list = ()) -> np.ndarray:
+        """
+        Condensed distance matrix of a selection, assembled from the tiles.
+        Distances between two partitions of skip are left uninitialized.
+        """
+        sizes = [len(self.partitions[key]) for key in keys]
+        offsets = np.concatenate(([0], np.cumsum(sizes)))
+        n = offsets[-1]
+        dist_matrix = np.empty(n * (n - 1) // 2)
+        for a, key_a in enumerate(keys):
+            for b in range(a, len(keys)):
+                if key_a in skip and keys[b] in skip:
+                    continue
+                if a == b:
+                    (rows, cols) = np.triu_indices(sizes[a], k=1)
+                else:
+                    (rows, cols) = np.indices((sizes[a], sizes[b])).reshape(2, -1)
+                dist_matrix[condensed_index(rows + offsets[a], cols + offsets[b], n)] = self.tile(key_a, keys[b]).ravel()
+        return dist_matrix
+
+    def single_linkage(self, keys: list) -> np.ndarray:
+        """
+        Single linkage from the minimum spanning tree, updated from the last one when partitions were added.
+        """
+        positions = np.concatenate([self.partitions[key] for key in keys])
+        n = len(positions)
+        (old_tree, old_keys) = (None, [])
+        mst = self.mst
+        if mst is not None and set(mst[0]) <= set(keys):
+            (old_keys, edges, weights) = mst
+            local = np.empty(len(self.encoded), dtype=int)
+            local[positions] = np.arange(n)
+            is_old = np.isin(positions, np.concatenate([self.partitions[key] for key in old_keys]))
+            old_tree = (local[edges[0]], local[edges[1]], weights, is_old)
+        # prim_mst doesn't read distances between rows of the old tree
+        (rows, cols, weights) = prim_mst(self.condensed_distances(keys, skip=old_keys), n, old_tree)
+        self.mst = (keys, (positions[rows], positions[cols]), weights)
+        return mst_linkage(rows, cols, weights, n)
+
+    def linkage(self, states: list, years: list, selected_method='complete') -> tuple:
+        """
+        Apply clustering algorithm to a selection. Return one-hot encoded data and the linkage matrix.
+        """
+        keys = self.selection(states, years)
+        if not keys:
+            raise ValueError("clustering.IncrementalLinkage.linkage: no data for the selected states and years\n")
+        positions = np.concatenate([self.partitions[key] for key in keys])
+        with diagnostics.span('incremental_linkage', rows_in=len(positions)) as record:
+            with self.tiles_lock:
+                linkage_matrix = self.results.get((tuple(keys), selected_method))
+                if linkage_matrix is not None:
+                    self.results.move_to_end((tuple(keys), selected_method))
+            if linkage_matrix is None:
+                if selected_method == 'single':
+                    linkage_matrix = self.single_linkage(keys)
+                else:
+                    linkage_matrix = linkage(self.condensed_distances(keys), method=selected_method)
+                with self.tiles_lock:
+                    self.results[(tuple(keys), selected_method)] = linkage_matrix
+                    while len(self.results) > results_kept:
+                        self.results.popitem(last=False)
+            df = self.encoded.iloc[positions]
+            output = diagnostics.frame_size(df)
+            record['rows_out'] = output['rows']
+            record['bytes_out'] = output['bytes']
+        return (df, linkage_matrix)
+
+def condensed_index(i, j, n: int):
+    """
+    Position of the distance between rows i < j in a condensed distance matrix of n rows.
+    """
+    return n * i - i * (i + 1) // 2 + j - i - 1
+
+def prim_mst(dist_matrix: np.ndarray, n: int, old_tree: tuple = None) -> tuple:
+    """
+    Edges (rows, columns, weights) of the minimum spanning tree of a condensed distance matrix.
+
+    old_tree (rows, columns, weights, mask of its rows) is the tree of a subset of the rows. Only its
+    edges can join two of those rows in the new tree, so distances between them are not read.
+    """
+    base = condensed_index(np.arange(n), 0, n) # Distance between rows i < j is dist_matrix[base[i] + j]
+    is_old = np.zeros(n, dtype=bool)
+    neighbors = [[] for _ in range(n)]
+    if old_tree is not None:
+        (old_rows, old_cols, old_weights, is_old) = old_tree
+        for (i, j, weight) in zip(old_rows, old_cols, old_weights):
+            neighbors[i].append((j, weight))
+            neighbors[j].append((i, weight))
+    # Rows not in the tree yet, their distance to the tree and closest row in the tree (first 'size' entries are valid)
+    remaining = np.arange(n)
+    position = np.arange(n)
+    best = np.full(n, np.inf)
+    closest = np.zeros(n, dtype=int)
+    (rows, cols, weights) = (np.empty(n - 1, dtype=int), np.empty(n - 1, dtype=int), np.empty(n - 1))
+    k = 0
+    for size in range(n, 0, -1):
+        j = remaining[k]
+        if size < n:
+            (rows[n - 1 - size], cols[n - 1 - size], weights[n - 1 - size]) = (closest[k], j, best[k])
+        # Move the last remaining row to position k
+        (remaining[k], best[k], closest[k]) = (remaining[size - 1], best[size - 1], closest[size - 1])
+        position[remaining[k]] = k
+        size -= 1
+        if size == 0:
+            break
+        # Update distances to the tree with the edges of row j
+        candidates = np.arange(size) if not is_old[j] else np.flatnonzero(~is_old[remaining[:size]])
+        others = remaining[candidates]
+        dist = dist_matrix[base[np.minimum(others, j)] + np.maximum(others, j)]
+        for (other, weight) in neighbors[j]:
+            if position[other] < size and remaining[position[other]] == other:
+                candidates = np.append(candidates, position[other])
+                dist = np.append(dist, weight)
+        closer = dist < best[candidates]
+        best[candidates[closer]] = dist[closer]
+        closest[candidates[closer]] = j
+        k = np.argmin(best[:size])
+    return (rows, cols, weights)
+
+def mst_linkage(rows, cols, weights, n: int) -> np.ndarray:
+    """
+    Single linkage matrix from the edges of a minimum spanning tree.
+    """
+    if len(weights) != n - 1:
+        raise ValueError("clustering.mst_linkage: the tree must connect all rows\n")
+    parent = np.arange(2 * n - 1)
+    size = np.ones(2 * n - 1)
+    linkage_matrix = np.empty((n - 1, 4))
+
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    for k, edge in enumerate(np.argsort(weights, kind='stable')):
+        (a, b) = sorted((find(rows[edge]), find(cols[edge])))
+        size[n + k] = size[a] + size[b]
+        linkage_matrix[k] = (a, b, weights[edge], size[n + k])
+        parent[a] = parent[b] = n + k
+    return linkage_matrix
@@ -0,0 +1,179 @@
+"""
+Instrumentation for the data pipeline: timing, memory and row counts per stage, with optional profiling.
+
+Spans are kept in memory (see the Diagnostics page) and logged as JSON lines.
+Set SIM_DIAGNOSTICS_LOG to a file path (or '-' for stderr) to write the log and
+SIM_PROFILER to 'cprofile' or 'pyinstrument' to profile every stage.
+"""
+
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+import psutil
+
+try:
+    import resource # Unix only
+except ImportError:
+    resource = None
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+available_profilers = ['cprofile', 'pyinstrument']
+profile_dir = './data/profiles'
+
+logger = logging.getLogger('sim_explorer.diagnostics')
+spans = deque(maxlen=1000) # Most recent spans, oldest first
+profiler = None
+_thread = threading.local() # profiling: a profiler is already running in an enclosing span of this thread
+
+def configure_logging(path: str = '-', level: int = logging.INFO) -> None:
+    """
+    Write spans as JSON lines to a file, or to stderr if path is '-'.
+    """
+    if path == '-':
+        handler = logging.StreamHandler(sys.stderr)
+    else:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(level)
+
+def set_profiler(name: str = None) -> None:
+    """
+    Enable per-stage profiling with 'cprofile' or 'pyinstrument', or disable it with None.
+    """
+    global profiler
+    if name is not None and name not in available_profilers:
+        raise ValueError(f"diagnostics.set_profiler: available profilers are {', '.join(available_profilers)}\n")
+    if name == 'pyinstrument' and Profiler is None:
+        raise ImportError("diagnostics.set_profiler: pyinstrument is not installed\n")
+    profiler = name
+
+def peak_rss() -> float:
+    """
+    Peak resident set size of the process (MB), None if the platform doesn't report it.
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+        return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+    # Peak working set on Windows
+    peak = getattr(psutil.Process().memory_info(), 'peak_wset', None)
+    return None if peak is None else peak / 2**20
+
+def frame_size(obj) -> dict:
+    """
+    Number of rows and (shallow) size in bytes of a dataframe, if obj is one.
+    """
+    if isinstance(obj, tuple) and len(obj) > 0:
+        obj = obj[0]
+    if isinstance(obj, pd.DataFrame):
+        return {'rows': len(obj), 'bytes': int(obj.memory_usage(index=True).sum())}
+    return {}
+
+@contextmanager
+def span(stage: str, **fields):
+    """
+    Measure a pipeline stage. The yielded record can be filled with more fields (e.g. rows).
+    """
+    record = {'stage': stage, 'start': datetime.now().isoformat(timespec='seconds')}
+    record.update(fields)
+    process = psutil.Process()
+    rss_start = process.memory_info().rss
+    stage_profiler = None
+    if profiler is not None and not getattr(_thread, 'profiling', False):
+        if profiler == 'cprofile':
+            stage_profiler = cProfile.Profile()
+            try:
+                stage_profiler.enable()
+            except ValueError:
+                # Python 3.12+ runs a single cProfile at a time, even in different threads
+                stage_profiler = None
+        else:
+            stage_profiler = Profiler()
+            stage_profiler.start()
+        _thread.profiling = stage_profiler is not None
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = round(time.perf_counter() - start, 4)
+        if stage_profiler is not None:
+            record['profile'] = save_profile(stage_profiler, stage)
+            _thread.profiling = False
+        rss_end = process.memory_info().rss
+        record['rss_mb'] = round(rss_end / 2**20, 1)
+        record['rss_delta_mb'] = round((rss_end - rss_start) / 2**20, 1)
+        peak = peak_rss()
+        record['peak_rss_mb'] = None if peak is None else round(peak, 1)
+        spans.append(record)
+        logger.info(json.dumps(record, default=str))
+
+def traced(stage: str):
+    """
+    Decorator to measure a function as a pipeline stage, with the rows of its input and output dataframes.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            rows_in = frame_size(args[0]).get('rows') if args else None
+            with span(stage, rows_in=rows_in) as record:
+                result = func(*args, **kwargs)
+                output = frame_size(result)
+                record['rows_out'] = output.get('rows')
+                record['bytes_out'] = output.get('bytes')
+            return result
+        return wrapper
+    return decorator
+
+def save_profile(stage_profiler, stage: str) -> str:
+    """
+    Stop the profiler and save its results. Return the file path.
+    """
+    os.makedirs(profile_dir, exist_ok=True)
+    name = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{stage}"
+    if isinstance(stage_profiler, cProfile.Profile):
+        stage_profiler.disable()
+        path = os.path.join(profile_dir, f"{name}.prof")
+        stage_profiler.dump_stats(path)
+    else:
+        stage_profiler.stop()
+        path = os.path.join(profile_dir, f"{name}.html")
+        with open(path, 'w') as file:
+            file.write(stage_profiler.output_html())
+    return path
+
+def profile_summary(path: str, lines: int = 25) -> str:
+    """
+    Text summary of a cProfile file, sorted by cumulative time.
+    """
+    stream = io.StringIO()
+    pstats.Stats(path, stream=stream).sort_stats('cumulative').print_stats(lines)
+    return stream.getvalue()
+
+def spans_df() -> pd.DataFrame:
+    """
+    Recorded spans as a dataframe.
+    """
+    return pd.DataFrame(list(spans))
+
+if os.environ.get('SIM_DIAGNOSTICS_LOG'):
+    configure_logging(os.environ['SIM_DIAGNOSTICS_LOG'])
+if os.environ.get('SIM_PROFILER'):
+    set_profiler(os.environ['SIM_PROFILER'])
@@ -9,6 +9,7 @@ import os
 from pysus.online_data import SIM, CNES, IBGE, parquets_to_dataframe
 
 import util
+import diagnostics
 
 download_states = util.available_states
 download_years = util.available_years
@@ -24,63 +25,100 @@ def get_SIM(states: list = download_states, years: list = download_years) -> pd.
     except FileNotFoundError:
         print("get_SIM: preprocessed data not found in cache, working on it...")
         df_SIM_raw = get_db_raw('SIM', states=states, years=years)
-        SIM_selection = ['DTOBITO', 'HORAOBITO', 'CAUSABAS', 'LOCOCOR', 'CODMUNRES', 'IDADE', 'SEXO', 'RACACOR', 'ESC', 'ESTCIV']
-        df_SIM = df_SIM_raw[SIM_selection]
-        df_SIM = df_SIM.rename(columns={'CODMUNRES': 'CODMUN'})
-        # Fix: remove white spaces from data
-        for col in df_SIM:
-            df_SIM[col] = df_SIM[col].astype(str).apply(str.strip)
-        # Select only suicide deaths
-        df_SIM['CAUSABAS'] = df_SIM['CAUSABAS'].str[:3]
-        df_SIM = df_SIM.loc[df_SIM['CAUSABAS'].isin(util.dict_methods.keys())]
-        # Decode features
-        df_SIM['IDADE'] = df_SIM['IDADE'].apply(util.decode_age)
-        df_SIM['DTOBITO'] = df_SIM['DTOBITO'].apply(util.decode_date)
-        translate_SIM(df_SIM)
-        df_SIM['CODMUN'] = df_SIM['CODMUN'].astype(int)
+        df_SIM = preprocess_SIM(df_SIM_raw, get_municipality(), years)
+        with diagnostics.span('write', database='SIM', rows=len(df_SIM)):
+            df_SIM.to_csv('./data/preprocessed_SIM.csv', index=False)
+    return df_SIM
 
-        ### Feature Extraction ###
-        # 'DTOBITO' -> 'ano_obito', 'dia_obito', 'mes_obito', 'fim_semana', 'feriado', 'estacao_ano'
-        df_SIM['year'] = df_SIM['DTOBITO'].apply(util.get_year)
-        df_SIM['month'] = df_SIM['DTOBITO'].apply(util.get_month)
-        df_SIM['day'] = df_SIM['DTOBITO'].apply(util.get_day)
-        df_SIM['season'] = df_SIM['DTOBITO'].apply(util.get_season)
-        df_SIM['weekday'] = df_SIM['DTOBITO'].apply(util.get_weekday)
-        df_SIM['holiday'] = df_SIM['DTOBITO'].apply(util.is_holiday, args=[1])
-        # Get municipality data and calculate suicide rates
-        df_muni = get_municipality()
-        suicide_rates = []
-        drop_list = []
-        for year in years:
-            # Get number of deaths per municipality and year
-            suicides_year = df_SIM.loc[df_SIM['year'] == year]
-            suicides_year = suicides_year['CODMUN'].value_counts().reset_index()
-            suicides_year.columns = ['CODMUN', f'suicides_{year}']
-            df_muni = df_muni.merge(suicides_year, how='left', on='CODMUN')
-            df_muni[f'suicides_{year}'] = df_muni[f'suicides_{year}'].fillna(0)
-            df_muni[f'suicide_rate_{year}'] = df_muni[f'suicides_{year}'] / df_muni['pop_muni'].astype(int) * 100000
-            df_muni = df_muni.drop(columns=f'suicides_{year}')
-            drop_list.append(f'suicide_rate_{year}')
-            suicide_rates.append(f'suicide_rate_{year}')
-        df_muni['average_suicide_rate'] = df_muni[suicide_rates].mean(axis=1)
-        df_muni = df_muni.drop(columns=drop_list)
-        # Merge with municipality dataframe on municipality code
-        # 'CODMUN' -> 'state', 'name_muni', 'pop_muni', 'average_suicide_rate', 'facility_rate'
-        df_SIM['state'] = df_SIM['CODMUN'].apply(util.get_state)
-        df_SIM = df_SIM.merge(df_muni, how='left', on='CODMUN')
-        df_SIM = df_SIM.drop(columns='num_facilities')
-        # 'IDADE' -> 'age_group'
-        grupos = [10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
-        df_SIM['age_group'] = pd.cut(x=df_SIM['IDADE'], bins=grupos)
-        # 'CAUSABAS' -> 'method'
-        df_SIM['method'] = df_SIM['CAUSABAS'].apply(util.get_suicide_method)
-        # 'HORAOBITO' -> 'periodo_dia'
-        df_SIM['day_period'] = df_SIM['HORAOBITO'].apply(util.get_period)
-        # Fix dtypes and save as .csv
-        df_SIM = util.fix_numerical_dtypes(df_SIM)
-        df_SIM.to_csv('./data/preprocessed_SIM.csv', index=False)
+def preprocess_SIM(df_SIM_raw: pd.DataFrame, df_muni: pd.DataFrame, years: list = download_years) -> pd.DataFrame:
+    """
+    Run all preprocessing stages over raw SIM data.
+    """
+    df_SIM = strip_SIM(df_SIM_raw)
+    df_SIM = filter_suicides(df_SIM)
+    df_SIM = decode_SIM(df_SIM)
+    df_SIM = extract_features(df_SIM)
+    df_SIM = merge_municipality(df_SIM, df_muni, years)
+    # Fix dtypes
+    return util.fix_numerical_dtypes(df_SIM)
+
+@diagnostics.traced('strip')
+def strip_SIM(df_SIM_raw: pd.DataFrame) -> pd.DataFrame:
+    """
+    Select SIM attributes and remove white spaces from data.
+    """
+    SIM_selection = ['DTOBITO', 'HORAOBITO', 'CAUSABAS', 'LOCOCOR', 'CODMUNRES', 'IDADE', 'SEXO', 'RACACOR', 'ESC', 'ESTCIV']
+    df_SIM = df_SIM_raw[SIM_selection]
+    df_SIM = df_SIM.rename(columns={'CODMUNRES': 'CODMUN'})
+    for col in df_SIM:
+        df_SIM[col] = df_SIM[col].astype(str).apply(str.strip)
     return df_SIM
 
+@diagnostics.traced('icd_filter')
+def filter_suicides(df_SIM: pd.DataFrame) -> pd.DataFrame:
+    """
+    Select only suicide deaths (ICD10 codes X60 to X84).
+    """
+    df_SIM['CAUSABAS'] = df_SIM['CAUSABAS'].str[:3]
+    return df_SIM.loc[df_SIM['CAUSABAS'].isin(util.dict_methods.keys())]
+
+@diagnostics.traced('decode')
+def decode_SIM(df_SIM: pd.DataFrame) -> pd.DataFrame:
+    """
+    Decode age, date, municipality code and categorical attributes.
+    """
+    df_SIM['IDADE'] = df_SIM['IDADE'].apply(util.decode_age)
+    df_SIM['DTOBITO'] = df_SIM['DTOBITO'].apply(util.decode_date)
+    translate_SIM(df_SIM)
+    df_SIM['CODMUN'] = df_SIM['CODMUN'].astype(int)
+    return df_SIM
+
+@diagnostics.traced('feature_extraction')
+def extract_features(df_SIM: pd.DataFrame) -> pd.DataFrame:
+    """
+    Extract date, age, method and day period features.
+    """
+    # 'DTOBITO' -> 'ano_obito', 'dia_obito', 'mes_obito', 'fim_semana', 'feriado', 'estacao_ano'
+    df_SIM['year'] = df_SIM['DTOBITO'].apply(util.get_year)
+    df_SIM['month'] = df_SIM['DTOBITO'].apply(util.get_month)
+    df_SIM['day'] = df_SIM['DTOBITO'].apply(util.get_day)
+    df_SIM['season'] = df_SIM['DTOBITO'].apply(util.get_season)
+    df_SIM['weekday'] = df_SIM['DTOBITO'].apply(util.get_weekday)
+    df_SIM['holiday'] = df_SIM['DTOBITO'].apply(util.is_holiday, args=[1])
+    # 'IDADE' -> 'age_group'
+    grupos = [10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
+    df_SIM['age_group'] = pd.cut(x=df_SIM['IDADE'], bins=grupos)
+    # 'CAUSABAS' -> 'method'
+    df_SIM['method'] = df_SIM['CAUSABAS'].apply(util.get_suicide_method)
+    # 'HORAOBITO' -> 'periodo_dia'
+    df_SIM['day_period'] = df_SIM['HORAOBITO'].apply(util.get_period)
+    return df_SIM
+
+@diagnostics.traced('municipality_merge')
+def merge_municipality(df_SIM: pd.DataFrame, df_muni: pd.DataFrame, years: list = download_years) -> pd.DataFrame:
+    """
+    Calculate suicide rates per municipality and merge municipality data on municipality code.
+    """
+    suicide_rates = []
+    drop_list = []
+    for year in years:
+        # Get number of deaths per municipality and year
+        suicides_year = df_SIM.loc[df_SIM['year'] == year]
+        suicides_year = suicides_year['CODMUN'].value_counts().reset_index()
+        suicides_year.columns = ['CODMUN', f'suicides_{year}']
+        df_muni = df_muni.merge(suicides_year, how='left', on='CODMUN')
+        df_muni[f'suicides_{year}'] = df_muni[f'suicides_{year}'].fillna(0)
+        df_muni[f'suicide_rate_{year}'] = df_muni[f'suicides_{year}'] / df_muni['pop_muni'].astype(int) * 100000
+        df_muni = df_muni.drop(columns=f'suicides_{year}')
+        drop_list.append(f'suicide_rate_{year}')
+        suicide_rates.append(f'suicide_rate_{year}')
+    df_muni['average_suicide_rate'] = df_muni[suicide_rates].mean(axis=1)
+    df_muni = df_muni.drop(columns=drop_list)
+    # 'CODMUN' -> 'state', 'name_muni', 'pop_muni', 'average_suicide_rate', 'facility_rate'
+    df_SIM['state'] = df_SIM['CODMUN'].apply(util.get_state)
+    df_SIM = df_SIM.merge(df_muni, how='left', on='CODMUN')
+    return df_SIM.drop(columns='num_facilities')
+
 def get_CNES(states: list = download_states, years: list = download_years) -> pd.DataFrame:
     """
     Transforming CNES
@@ -153,7 +191,9 @@ def get_db_raw(database: str, states: list = download_states, years: list = down
     """
     raw_df = pd.DataFrame()
     try:
-        raw_df = pd.read_parquet(f'./data/rawdata/{database}.parquet')
+        with diagnostics.span('raw_read', database=database) as record:
+            raw_df = pd.read_parquet(f'./data/rawdata/{database}.parquet')
+            record.update(diagnostics.frame_size(raw_df))
         print(f"get_db_raw: raw {database} data found in cache.")
     except FileNotFoundError:
         print(f"get_db_raw: raw {database} data not found in cache, downloading from DATASUS...")
@@ -2,8 +2,17 @@
 Functions for data visualization.
 """
 
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
 import pandas as pd
+import geopandas as gpd
+import shapely.wkb
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import seaborn as sns
 import geobr
 from scipy.cluster.hierarchy import dendrogram
@@ -15,6 +24,11 @@ import util
 
 available_states = util.available_states
 available_years = util.available_years
+geometry_dir = './data/rawdata/geometry'
+map_processes = os.cpu_count() # Worker processes rendering state maps
+
+_geometry = {} # cache file -> municipality geometry, shared by the maps drawn in this process
+_map_executor = None
 
 def plot_dendrogram(linkage_matrix, levels: int) -> plt.figure:
     """
@@ -65,49 +79,141 @@ def two_feature_barplot(df: pd.DataFrame, plot_feature: str, axis_feature: str,
     ax.legend(loc='center left', bbox_to_anchor=(1, 0.5))
     return fig
 
-def feature_cluster_heatmap(df, feature: str) -> plt.figure:
+def feature_cluster_heatmap(profile: pd.DataFrame, feature: str, value: str = 'mean') -> plt.figure:
     """
     Generate heatmap for feature distribution per cluster.
+    profile is the table of cluster profiles (see clustering.cluster_profiles), value one of its columns.
     """
-    features = ["cluster"]
-    # Select all columns related to the feature (handle one-hot encoded features)
-    for column in df.columns:
-        if feature in column:
-            features.append(column)
-            
-    # Create a new dataframe with the cluster labels and the selected feature
-    df = df.loc[:, features]
-    means = df.groupby('cluster').mean()
+    # Select the feature's rows of the profile (one per cluster and encoded column)
+    values = profile.loc[profile['feature'] == feature].pivot(index='cluster', columns='column', values=value)
     fig, ax = plt.subplots()
-    ax = sns.heatmap(means, cmap='coolwarm', annot=True, fmt='.2f')
-    ax.set_title("Means of %s per cluster" % feature)
+    ax = sns.heatmap(values, cmap='coolwarm', annot=True, fmt='.2f')
+    ax.set_title(f"{value.capitalize()} of {feature} per cluster")
     return fig
 
-def state_geomap(df: pd.DataFrame, state, feature: str) -> plt.figure:
+def write_geometry_cache(state_map: gpd.GeoDataFrame, path: str) -> None:
     """
-    Generate a map of the state with distribution of a feature per municipality
+    Save municipality geometry as a plain parquet file, with geometries as WKB (readable by any geopandas version).
     """
-    state_map = geobr.read_municipality(code_muni=state)
-    #state_map['code_muni'] = (state_map['code_muni'] / 10).astype(int)
-    #df['CODMUN'] = df['CODMUN'].astype(int)
-    #state_map = state_map.merge(df, how='left', left_on='code_muni', right_on='CODMUN')
-    state_map['name_muni'] = state_map['name_muni'].str.lower()
-    df['name_muni'] = df['name_muni'].str.lower()
-    state_map = state_map.merge(df, how='left', on='name_muni')
-    fig, ax = plt.subplots(figsize=(15, 15), dpi=300)
+    df = pd.DataFrame(state_map.drop(columns=state_map.geometry.name))
+    df['geometry'] = [geometry.wkb for geometry in state_map.geometry]
+    # Write to a temporary file first, other processes may be reading the cache
+    df.to_parquet(f"{path}.{os.getpid()}.tmp", index=False)
+    os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+def read_geometry_cache(path: str) -> gpd.GeoDataFrame:
+    """
+    Read municipality geometry saved with write_geometry_cache.
+    """
+    df = pd.read_parquet(path)
+    geometry = [shapely.wkb.loads(bytes(geometry)) for geometry in df.pop('geometry')]
+    return gpd.GeoDataFrame(df, geometry=geometry)
+
+def load_geometry(state: str, directory: str = None) -> gpd.GeoDataFrame:
+    """
+    Get the municipality geometry of a state. Downloaded with geobr once and cached in ./data/rawdata/geometry/.
+    """
+    path = os.path.join(directory or geometry_dir, f"{state}.parquet")
+    if path not in _geometry:
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_geometry_cache(geobr.read_municipality(code_muni=state), path)
+        # Always read from the cache, so maps get the same geometry (without CRS) in every process
+        state_map = read_geometry_cache(path)
+        # geobr codes have a verification digit, SIM codes (CODMUN) do not
+        state_map['CODMUN'] = (state_map['code_muni'] // 10).astype(int)
+        # Only the merge key and geometry, so any feature (e.g. name_muni) can be merged without suffixes
+        _geometry[path] = state_map[['CODMUN', 'geometry']]
+    return _geometry[path]
+
+def municipality_values(df: pd.DataFrame, feature: str) -> pd.DataFrame:
+    """
+    Value of a feature per municipality: mean of a numerical feature, most frequent value of a categorical one.
+    """
+    if pd.api.types.is_numeric_dtype(df[feature]) and not pd.api.types.is_bool_dtype(df[feature]):
+        return df.groupby('CODMUN', as_index=False)[feature].mean()
+    counts = df.groupby(['CODMUN', feature]).size().reset_index(name='count')
+    return counts.sort_values('count', kind='stable').drop_duplicates('CODMUN', keep='last')[['CODMUN', feature]]
+
+def _plot_map(ax, state_map: gpd.GeoDataFrame, feature: str, title: str) -> None:
+    if pd.api.types.is_numeric_dtype(state_map[feature]) and not pd.api.types.is_bool_dtype(state_map[feature]):
+        legend_kwds = {
+            "label": "Number of suicides per 100k inhabitants",
+            "orientation": "vertical",
+            "shrink": 0.4,
+        }
+    else:
+        legend_kwds = {"loc": "center left", "bbox_to_anchor": (1, 0.5)}
     state_map.plot(
         column=feature,
         cmap="Blues",
         edgecolor="#FEBF57",
         legend=True,
-        legend_kwds={
-            "label": "Number of suicides per 100k inhabitants",
-            "orientation": "vertical",
-            "shrink": 0.4,
-        },
+        legend_kwds=legend_kwds,
+        missing_kwds={"color": "lightgrey"},
         ax=ax,
     )
-    ax.set_title(f"Distribution of {feature} in {state}", fontsize=20)
-    ax.legend(loc='center left', bbox_to_anchor=(1, 0.5))
+    ax.set_title(title, fontsize=20)
     ax.axis("off")
+
+def state_geomap(df: pd.DataFrame, state, feature: str) -> plt.figure:
+    """
+    Generate a map of the state with distribution of a feature per municipality
+    """
+    state_map = load_geometry(state).merge(municipality_values(df, feature), how='left', on='CODMUN')
+    fig, ax = plt.subplots(figsize=(15, 15), dpi=300)
+    _plot_map(ax, state_map, feature, f"Distribution of {feature} in {state}")
+    return fig
+
+def _render_state_map(values: pd.DataFrame, state: str, feature: str, directory: str = None) -> bytes:
+    """
+    Render a state map as PNG (run in worker processes, without pyplot).
+    """
+    state_map = load_geometry(state, directory).merge(values, how='left', on='CODMUN')
+    fig = Figure(figsize=(15, 15), dpi=300)
+    _plot_map(fig.subplots(), state_map, feature, f"Distribution of {feature} in {state}")
+    image = io.BytesIO()
+    fig.savefig(image, format='png')
+    return image.getvalue()
+
+def get_map_executor() -> ProcessPoolExecutor:
+    """
+    Get the worker processes rendering maps. They are started once and reused by later calls.
+    """
+    global _map_executor
+    if _map_executor is None:
+        # Spawn (not fork) the workers: the web app server is multithreaded
+        _map_executor = ProcessPoolExecutor(max_workers=map_processes, mp_context=multiprocessing.get_context('spawn'))
+    return _map_executor
+
+def state_geomaps(df: pd.DataFrame, states: list, feature: str) -> list:
+    """
+    Render a map of each state concurrently. Return the PNG images, in the order of states.
+    """
+    values = municipality_values(df.loc[df['state'].isin(states)], feature)
+    # Fill the geometry cache before starting the workers, so each state is downloaded once
+    for state in states:
+        load_geometry(state)
+    if len(states) <= 1 or map_processes <= 1:
+        return [_render_state_map(values, state, feature) for state in states]
+    global _map_executor
+    try:
+        return list(get_map_executor().map(_render_state_map, [values] * len(states), states,
+                                           [feature] * len(states), [geometry_dir] * len(states)))
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory): start new workers on the next call
+        _map_executor = None
+        raise
+
+def multi_state_geomap(df: pd.DataFrame, states: list, feature: str) -> plt.figure:
+    """
+    Generate a single map of several states with distribution of a feature per municipality
+    """
+    if not states:
+        raise ValueError("figures.multi_state_geomap: no states selected\n")
+    states_map = pd.concat([load_geometry(state) for state in states], ignore_index=True)
+    states_map = states_map.merge(municipality_values(df.loc[df['state'].isin(states)], feature), how='left', on='CODMUN')
+    fig, ax = plt.subplots(figsize=(15, 15), dpi=300)
+    _plot_map(ax, gpd.GeoDataFrame(states_map, geometry='geometry'), feature,
+              f"Distribution of {feature} in {', '.join(states)}")
     return fig
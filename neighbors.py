@@ -0,0 +1,133 @@
+"""
+Nearest-neighbor index over labeled data: similar records and cluster assignment of new records.
+
+The index is built over the encoded columns of a labeling run, with the euclidean distance used
+by the linkage. It is a k-d tree or a ball tree (scikit-learn) or, if scikit-learn is not installed,
+a brute-force search in NumPy. The k-d tree is the default: its axis-aligned splits suit the one-hot
+encoded columns, and it was the fastest on the benchmarks (see benchmarks/bench_neighbors.py).
+"""
+
+import copy
+import pickle
+
+import numpy as np
+import pandas as pd
+
+try:
+    from sklearn.neighbors import BallTree, KDTree
+    trees = {'kdtree': KDTree, 'balltree': BallTree}
+except ImportError:
+    trees = {}
+
+import clustering as cl
+import diagnostics
+
+available_backends = ['kdtree', 'balltree', 'brute']
+block_size = 2**24 # Distances computed at once by the brute-force search (128 MB)
+
+class NeighborIndex:
+    """
+    Index of the rows of labeled data (encoded columns and cluster labels).
+    Query results are positions of the indexed rows, nearest first.
+    """
+    def __init__(self, data, labels=None, columns: list = None, backend: str = None, leaf_size: int = 40):
+        if backend is None:
+            backend = 'kdtree' if trees else 'brute'
+        if backend not in available_backends:
+            raise ValueError(f"neighbors.NeighborIndex: available backends are {', '.join(available_backends)}\n")
+        if backend != 'brute' and not trees:
+            raise ImportError("neighbors.NeighborIndex: scikit-learn is not installed, use the brute backend\n")
+        data = np.ascontiguousarray(data, dtype=float)
+        self.backend = backend
+        self.columns = columns
+        self.labels = None if labels is None else np.asarray(labels)
+        self.size = len(data)
+        # Trees keep their own copy of the data
+        self.tree = trees[backend](data, leaf_size=leaf_size) if backend != 'brute' else None
+        self.data = data if self.tree is None else None
+
+    @classmethod
+    def from_labeled(cls, labeled_data: pd.DataFrame, **kwargs):
+        """
+        Build the index of labeled data, as returned by clustering.apply_labels.
+        Data without a cluster column is indexed without labels (see with_labels).
+        """
+        columns = [column for column in labeled_data.columns if column != 'cluster']
+        labels = labeled_data['cluster'].to_numpy() if 'cluster' in labeled_data.columns else None
+        with diagnostics.span('neighbor_index', rows_in=len(labeled_data)):
+            return cls(labeled_data[columns].to_numpy(dtype=float), labels, columns=columns, **kwargs)
+
+    def with_labels(self, labels) -> 'NeighborIndex':
+        """
+        Copy of the index with other cluster labels of the same rows. The tree is shared, not rebuilt.
+        """
+        if len(labels) != self.size:
+            raise ValueError(f"neighbors.NeighborIndex.with_labels: {len(labels)} labels for {self.size} rows\n")
+        index = copy.copy(self)
+        index.labels = np.asarray(labels)
+        return index
+
+    def encode(self, df: pd.DataFrame, features: list, fill_values: dict = None) -> np.ndarray:
+        """
+        Encode records (with the preprocessed data schema) into the indexed columns.
+        Missing data is imputed with fill_values (feature -> value) if given, e.g. the values imputed in
+        the indexed data, otherwise with the medians and modes of df.
+        Categories not found in the indexed data are left out (all their one-hot columns are 0).
+        """
+        encoded = cl.EncodedFeatures(df, fill_values).select(features)
+        return encoded.reindex(columns=self.columns, fill_value=0.0).to_numpy(dtype=float)
+
+    def query(self, X, k: int = 5) -> tuple:
+        """
+        Get the k nearest indexed rows of each row of X. Return their distances and positions.
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        k = min(k, self.size)
+        if self.tree is not None:
+            return self.tree.query(X, k=k)
+        return brute_force_knn(self.data, X, k)
+
+    def assign(self, X, k: int = 1) -> np.ndarray:
+        """
+        Assign each row of X to a cluster: the most frequent label among its k nearest rows.
+        Ties go to the label of the nearest row.
+        """
+        if self.labels is None:
+            raise ValueError("neighbors.NeighborIndex.assign: the index has no cluster labels\n")
+        (_, positions) = self.query(X, k)
+        neighbor_labels = self.labels[positions]
+        # Number of neighbors sharing the label of each neighbor, first maximum is the nearest
+        votes = (neighbor_labels[:, :, None] == neighbor_labels[:, None, :]).sum(axis=2)
+        return neighbor_labels[np.arange(len(neighbor_labels)), votes.argmax(axis=1)]
+
+    def save(self, path: str) -> None:
+        with open(path, 'wb') as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+def load_index(path: str) -> NeighborIndex:
+    """
+    Load an index saved with NeighborIndex.save.
+    """
+    with open(path, 'rb') as file:
+        return pickle.load(file)
+
+def brute_force_knn(data: np.ndarray, X: np.ndarray, k: int) -> tuple:
+    """
+    Exact k nearest rows of data for each row of X, by computing all distances (in blocks of rows of X).
+    """
+    chunk_size = max(1, block_size // len(data))
+    data_norms = np.einsum('ij,ij->i', data, data)
+    distances = np.empty((len(X), k))
+    positions = np.empty((len(X), k), dtype=np.intp)
+    for start in range(0, len(X), chunk_size):
+        block = X[start:start + chunk_size]
+        # Squared distances |x|^2 - 2 x.y + |y|^2
+        squared = np.einsum('ij,ij->i', block, block)[:, None] - 2 * block @ data.T + data_norms
+        np.maximum(squared, 0, out=squared)
+        nearest = np.argpartition(squared, k - 1, axis=1)[:, :k] if k < len(data) else \
+            np.broadcast_to(np.arange(len(data)), (len(block), len(data)))
+        nearest_squared = np.take_along_axis(squared, nearest, axis=1)
+        order = np.argsort(nearest_squared, axis=1, kind='stable')
+        positions[start:start + len(block)] = np.take_along_axis(nearest, order, axis=1)
+        distances[start:start + len(block)] = np.sqrt(np.take_along_axis(nearest_squared, order, axis=1))
+    return (distances, positions)
@@ -8,7 +8,7 @@ import pandas as pd
 
 import download as dl
 import util
-from figures import two_feature_barplot, state_geomap
+from figures import two_feature_barplot, state_geomaps, multi_state_geomap
 
 st.write(
     """
@@ -47,8 +47,14 @@ if plot == plot_opt[0]:
 
 elif plot == plot_opt[1]:
     # "Feature distribution per municipality"
-    st.write("This option will display a map for each selected state.")
+    st.write("This option will display a map for each selected state, or a single map of all of them.")
     feature = st.selectbox("Feature: ", options=preprocessed_data.columns)
+    combined = st.checkbox("Combined map of the selected states?")
     if st.button(label="Plot", type="primary"):
-        for state in selected_states:
-            st.pyplot(state_geomap(preprocessed_data, state, feature))
+        if not selected_states:
+            st.info("Select at least one state to plot.")
+        elif combined:
+            st.pyplot(multi_state_geomap(preprocessed_data, selected_states, feature))
+        else:
+            for image in state_geomaps(preprocessed_data, selected_states, feature):
+                st.image(image)
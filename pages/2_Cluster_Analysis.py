@@ -3,12 +3,14 @@ Web app: cluster analysis functions.
 """
 
 import streamlit as st
-import pandas as pd
 import numpy as np
 import re
+import uuid
 
 import download as dl
 import clustering as cl
+import neighbors
+import runs
 import util
 from figures import plot_dendrogram, feature_cluster_heatmap, state_geomap
 
@@ -22,8 +24,7 @@ st.write(
 preprocessed_data = dl.get_SIM()
 selected_states = st.multiselect("States: ", options=util.available_states, default=util.available_states)
 selected_years = st.multiselect("Years: ", options=util.available_years, default=util.available_years)
-default_columns = ['IDADE', 'LOCOCOR', 'SEXO', 'RACACOR', 'ESC', 'ESTCIV', 'age_group', 'method', 'season', 'day_period', 'weekday', 'facility_rate']
-selected_feats = st.multiselect("Features: ", options=preprocessed_data.columns.to_list(), default=default_columns)
+selected_feats = st.multiselect("Features: ", options=preprocessed_data.columns.to_list(), default=cl.default_features)
 selected_method = st.selectbox("Clustering method: ", options=['Single (nearest point)',
                                                       'Complete (farthest point)',
                                                       'Average (UPGMA)',
@@ -31,11 +32,33 @@ selected_method = st.selectbox("Clustering method: ", options=['Single (nearest
                                                       'Centroid (UPGMC)',
                                                       'Median (WPGMC)',
                                                       'Ward']).split()[0].lower()
-selected_data = preprocessed_data[selected_feats].loc[(preprocessed_data['state'].isin(selected_states)) & 
-                                                      (preprocessed_data['year'].isin(selected_years))]
+
+@st.cache_resource
+def get_encoded_features(_df):
+    """
+    Encoded features of the preprocessed data, shared by all sessions.
+    """
+    return cl.EncodedFeatures(_df)
+
+encoded_features = get_encoded_features(preprocessed_data)
+
+@st.cache_resource(max_entries=4)
+def get_incremental_linkage(_df, _encoded, features: tuple):
+    """
+    Hierarchical clustering of a feature list, with its distance tiles shared by all sessions.
+    """
+    return cl.IncrementalLinkage(_df, list(features), _encoded)
+
+def apply_linkage() -> tuple:
+    """
+    Apply clustering to the selected data. Encoded data and distances are kept between reruns,
+    so changing the selected states and years only computes what is new.
+    """
+    incremental_linkage = get_incremental_linkage(preprocessed_data, encoded_features, tuple(selected_feats))
+    return incremental_linkage.linkage(selected_states, selected_years, selected_method)
 
 if st.button(label="Plot Dendrogram", type='primary'):
-    (onehot_data, linkage_matrix) = cl.apply_linkage(selected_data, selected_method)
+    (onehot_data, linkage_matrix) = apply_linkage()
     dendro = plot_dendrogram(linkage_matrix, levels=4)
     st.pyplot(dendro)
 
@@ -54,7 +77,7 @@ gen_plots = st.checkbox("Generate silhouette coefficient plots?")
 collect_numbers = lambda x : [int(i) for i in re.split("[^0-9]", x) if i != ""]
 dist_values = collect_numbers(list_input)
 if st.button(label="Evaluate", type='primary'):
-    (onehot_data, linkage_matrix) = cl.apply_linkage(selected_data, selected_method)
+    (onehot_data, linkage_matrix) = apply_linkage()
     (results, plots) = cl.evaluate_clustering(onehot_data, linkage_matrix, dist_values, gen_plots)
     st.write(results)
     if gen_plots:
@@ -63,15 +86,47 @@ if st.button(label="Evaluate", type='primary'):
 
 st.write("""
     **Set the distance threshold and label the data.**\n
-    A column named "cluster" will be added to the dataset.
+    A column named "cluster" will be added to the dataset. Each labeling is saved as a new run.
     """
 )
 
-labeled_data = pd.read_csv('./data/labeled_data.csv')
+if 'session_id' not in st.session_state:
+    # The session id is kept in the page URL, so earlier runs are still listed after reloading the page
+    session_id = st.experimental_get_query_params().get('session', [''])[0]
+    if not re.fullmatch('[0-9a-f]{32}', session_id):
+        session_id = uuid.uuid4().hex
+        st.experimental_set_query_params(session=session_id)
+    st.session_state['session_id'] = session_id
+    # Delete the runs of abandoned sessions
+    runs.cleanup_runs()
+session_id = st.session_state['session_id']
+
 dist_threshold = st.number_input(label="Distance threshold:", min_value=1, step=1)
 if st.button(label="Apply", type='primary'):
-    (onehot_data, linkage_matrix) = cl.apply_linkage(selected_data, selected_method)
+    (onehot_data, linkage_matrix) = apply_linkage()
+    (metrics, _) = cl.evaluate_clustering(onehot_data, linkage_matrix, [dist_threshold])
     labeled_data = cl.apply_labels(onehot_data, linkage_matrix, dist_threshold)
+    feature_columns = encoded_features.feature_columns(selected_feats)
+    profile = cl.cluster_profiles(labeled_data, feature_columns)
+    params = {'states': selected_states, 'years': selected_years, 'features': selected_feats,
+              'method': selected_method, 'threshold': dist_threshold, 'feature_columns': feature_columns,
+              'fill_values': encoded_features.fill_values(selected_feats)}
+    index = neighbors.NeighborIndex.from_labeled(labeled_data)
+    st.session_state['run_id'] = runs.save_run(labeled_data, linkage_matrix, params, metrics, profile, index,
+                                               session=session_id)
+
+# Runs labeled in this session and by batch mode
+run_list = runs.list_runs([session_id, 'batch'])
+if run_list.empty:
+    st.info("No labeled data yet. Apply a distance threshold to label the selected data.")
+    st.stop()
+run_ids = run_list['run_id'].tolist()
+describe_run = run_list.set_index('run_id').apply(
+    lambda run: f"{run['created']} - {run['method']}, threshold {run['threshold']:g}, {run['clusters']} clusters", axis=1)
+run_id = st.selectbox("Run: ", options=run_ids, format_func=describe_run.get,
+                      index=run_ids.index(st.session_state['run_id']) if st.session_state.get('run_id') in run_ids else 0)
+run = runs.load_run(run_id)
+labeled_data = run.labeled_data
 
 st.write(
     """
@@ -79,6 +134,12 @@ st.write(
     """,
     labeled_data['cluster'].value_counts()
 )
+if run.metrics is not None:
+    st.write(run.metrics)
+
+profile = run.profile
+st.download_button(label="Download cluster profiles (.csv)", data=profile.to_csv(index=False),
+                   file_name=f"profiles_{run_id}.csv", mime='text/csv')
 
 categorical_features = labeled_data.select_dtypes(exclude=[np.number]).columns.tolist()
 
@@ -87,10 +148,36 @@ plot_opt = ["Feature distribution per cluster (heatmap)",
 
 plot = st.selectbox("Select a plot to visualize: ", options=plot_opt)
 if plot == plot_opt[0]:
-    feature = st.selectbox("Feature:", options=selected_feats)
+    feature = st.selectbox("Feature:", options=run.params['params']['features'])
+    value = st.selectbox("Value:", options=['mean', 'lift'],
+                         format_func=lambda x: "Mean (proportion of one-hot columns)" if x == 'mean' else "Lift (cluster mean / population mean)")
     if st.button(key="heatmap", label="Plot", type="primary"):
-        st.pyplot(feature_cluster_heatmap(labeled_data, feature))
+        st.pyplot(feature_cluster_heatmap(profile, feature, value))
 elif plot == plot_opt[1]:
     state = st.selectbox("Feature:", options=categorical_features)
     if st.button(key="geomap", label="Plot", type="primary"):
         st.pyplot(state_geomap(labeled_data, state))
+
+st.write("**Find similar records and assign new records to the clusters.**")
+
+index = run.neighbor_index
+n_neighbors = st.number_input(label="Number of neighbors:", min_value=1, max_value=50, value=5, step=1)
+record = st.number_input(label="Record (row of the labeled data):", min_value=0, max_value=len(labeled_data) - 1, step=1)
+if st.button(label="Find similar records", type="primary"):
+    (distances, positions) = index.query(labeled_data.drop(columns='cluster').iloc[[record]], n_neighbors + 1)
+    # The record itself is its nearest neighbor
+    similar = [(distance, position) for (distance, position) in zip(distances[0], positions[0]) if position != record]
+    similar_data = labeled_data.iloc[[position for (_, position) in similar[:n_neighbors]]].copy()
+    similar_data.insert(0, 'distance', [distance for (distance, _) in similar[:n_neighbors]])
+    st.write(similar_data)
+if st.button(label="Assign selected data to clusters", type="primary"):
+    # Records of the selected states and years, labeled with the clusters of their nearest neighbors
+    assigned_data = preprocessed_data.loc[(preprocessed_data['state'].isin(selected_states)) &
+                                          (preprocessed_data['year'].isin(selected_years))].copy()
+    # Missing data is imputed with the values of the run (runs saved without them use the selected data)
+    run_params = run.params['params']
+    encoded = index.encode(assigned_data, run_params['features'], run_params.get('fill_values'))
+    assigned_data['cluster'] = index.assign(encoded, n_neighbors)
+    st.write("Records per cluster: ", assigned_data['cluster'].value_counts())
+    st.download_button(label="Download assigned data (.csv)", data=assigned_data.to_csv(index=False),
+                       file_name=f"assigned_{run_id}.csv", mime='text/csv')
@@ -0,0 +1,47 @@
+"""
+Web app: pipeline diagnostics.
+"""
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+import diagnostics
+
+st.write(
+    """
+    ### Diagnostics
+    **Time, memory and number of rows of each pipeline stage run by this server.**
+    """
+)
+
+profiler_opt = [None] + diagnostics.available_profilers
+selected_profiler = st.selectbox("Profile each stage with: ", options=profiler_opt,
+                                 index=profiler_opt.index(diagnostics.profiler),
+                                 format_func=lambda x: "No profiling" if x is None else x)
+if selected_profiler != diagnostics.profiler:
+    try:
+        diagnostics.set_profiler(selected_profiler)
+    except ImportError as e:
+        st.error(e)
+
+spans = diagnostics.spans_df()
+if spans.empty:
+    st.info("No stage has run yet. Open the other pages to load and cluster the data.")
+    st.stop()
+
+st.write("Recorded stages (most recent last): ", spans)
+st.write("Total time per stage (seconds): ", spans.groupby('stage')['seconds'].agg(['count', 'sum', 'mean']))
+if st.button(label="Clear", type="primary"):
+    diagnostics.spans.clear()
+    st.experimental_rerun()
+
+if 'profile' in spans:
+    profiles = spans['profile'].dropna().tolist()
+    if profiles:
+        st.write("**Profiles**")
+        path = st.selectbox("Profile: ", options=profiles[::-1])
+        if path.endswith('.prof'):
+            st.code(diagnostics.profile_summary(path))
+        else:
+            with open(path) as file:
+                components.html(file.read(), height=600, scrolling=True)
@@ -0,0 +1,177 @@
+"""
+Store for clustering runs: labeled data, linkage matrix, parameters and metrics of each labeling.
+
+Runs are saved in ./data/runs/<session>/<run_id>/ and never overwritten:
+    labels.parquet   labeled (one-hot encoded) data, zstd compressed
+    linkage.npy      linkage matrix, memory-mapped when loaded
+    metrics.parquet  evaluation metrics (optional)
+    profile.parquet  cluster profiles (optional)
+    neighbors.pkl    nearest-neighbor index of the labeled data (optional, see neighbors.py)
+    params.json      parameters and run information, written last
+"""
+
+import glob
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import neighbors
+
+run_dir = './data/runs'
+format_version = 1
+retention_days = 30 # Runs of browser sessions without a new run for this long are deleted
+max_loaded = 8 # Runs kept in memory, shared by all sessions
+
+class Run:
+    """
+    A stored run. Artifacts are only read when first accessed.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, 'params.json')) as file:
+            self.params = json.load(file)
+        self.run_id = self.params['run_id']
+        self._labeled_data = None
+        self._linkage_matrix = None
+        self._metrics = None
+        self._profile = None
+        self._neighbor_index = None
+
+    @property
+    def labeled_data(self) -> pd.DataFrame:
+        if self._labeled_data is None:
+            self._labeled_data = pd.read_parquet(os.path.join(self.path, 'labels.parquet'), memory_map=True)
+        return self._labeled_data
+
+    @property
+    def linkage_matrix(self) -> np.ndarray:
+        if self._linkage_matrix is None:
+            self._linkage_matrix = np.load(os.path.join(self.path, 'linkage.npy'), mmap_mode='r')
+        return self._linkage_matrix
+
+    @property
+    def metrics(self) -> pd.DataFrame:
+        if self._metrics is None and os.path.exists(os.path.join(self.path, 'metrics.parquet')):
+            self._metrics = pd.read_parquet(os.path.join(self.path, 'metrics.parquet'))
+        return self._metrics
+
+    @property
+    def profile(self) -> pd.DataFrame:
+        if self._profile is None and os.path.exists(os.path.join(self.path, 'profile.parquet')):
+            self._profile = pd.read_parquet(os.path.join(self.path, 'profile.parquet'), memory_map=True)
+        return self._profile
+
+    @property
+    def neighbor_index(self) -> neighbors.NeighborIndex:
+        if self._neighbor_index is None:
+            try:
+                self._neighbor_index = neighbors.load_index(os.path.join(self.path, 'neighbors.pkl'))
+            except (FileNotFoundError, ImportError):
+                # Runs saved without an index, or with a tree backend that is not installed
+                self._neighbor_index = neighbors.NeighborIndex.from_labeled(self.labeled_data)
+        return self._neighbor_index
+
+_loaded = OrderedDict() # run_id -> Run, least recently used first
+_loaded_lock = threading.Lock()
+
+def save_run(labeled_data: pd.DataFrame, linkage_matrix, params: dict, metrics: pd.DataFrame = None,
+             profile: pd.DataFrame = None, index: neighbors.NeighborIndex = None, session: str = 'shared') -> str:
+    """
+    Save a labeling run. Return its id.
+    """
+    run_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    path = os.path.join(run_dir, session, run_id)
+    # Write into a temporary directory first, so incomplete runs are never listed
+    tmp_path = os.path.join(run_dir, session, f".{run_id}.tmp")
+    os.makedirs(tmp_path)
+    try:
+        labeled_data.to_parquet(os.path.join(tmp_path, 'labels.parquet'), compression='zstd', index=False)
+        np.save(os.path.join(tmp_path, 'linkage.npy'), np.asarray(linkage_matrix))
+        if metrics is not None:
+            metrics.to_parquet(os.path.join(tmp_path, 'metrics.parquet'), index=False)
+        if profile is not None:
+            profile.to_parquet(os.path.join(tmp_path, 'profile.parquet'), compression='zstd', index=False)
+        if index is not None:
+            index.save(os.path.join(tmp_path, 'neighbors.pkl'))
+        info = {
+            'run_id': run_id,
+            'session': session,
+            'version': format_version,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'rows': len(labeled_data),
+            'clusters': int(labeled_data['cluster'].nunique())
+        }
+        with open(os.path.join(tmp_path, 'params.json'), 'w') as file:
+            json.dump({**info, 'params': params}, file, indent=2, default=str)
+        os.rename(tmp_path, path)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    return run_id
+
+def list_runs(sessions: list = None) -> pd.DataFrame:
+    """
+    List stored runs of some sessions (all sessions if None), newest first.
+    """
+    if sessions is None:
+        sessions = ['*']
+    runs = []
+    for session in sessions:
+        for path in glob.glob(os.path.join(run_dir, session, '*', 'params.json')):
+            with open(path) as file:
+                info = json.load(file)
+            params = info.pop('params')
+            runs.append({**info, **params})
+    if not runs:
+        return pd.DataFrame(columns=['run_id', 'session', 'version', 'created', 'rows', 'clusters'])
+    return pd.DataFrame(runs).sort_values(['created', 'run_id'], ascending=False).reset_index(drop=True)
+
+def load_run(run_id: str) -> Run:
+    """
+    Get a stored run. The most recently used runs are kept in memory.
+    """
+    with _loaded_lock:
+        if run_id in _loaded:
+            _loaded.move_to_end(run_id)
+            return _loaded[run_id]
+    paths = glob.glob(os.path.join(run_dir, '*', run_id))
+    if not paths:
+        raise FileNotFoundError(f"runs.load_run: run {run_id} not found in {run_dir}\n")
+    run = Run(paths[0])
+    with _loaded_lock:
+        _loaded[run_id] = run
+        while len(_loaded) > max_loaded:
+            _loaded.popitem(last=False)
+    return run
+
+def cleanup_runs(max_age_days: float = retention_days, keep_sessions: tuple = ('batch', 'shared')) -> list:
+    """
+    Delete the runs of sessions with no new run in max_age_days (except keep_sessions). Return the deleted sessions.
+    """
+    limit = time.time() - max_age_days * 86400
+    deleted = []
+    for path in glob.glob(os.path.join(run_dir, '*')):
+        session = os.path.basename(path)
+        if session in keep_sessions or not os.path.isdir(path):
+            continue
+        try:
+            last_change = max([os.path.getmtime(path)] + [entry.stat().st_mtime for entry in os.scandir(path)])
+        except FileNotFoundError:
+            continue
+        if last_change < limit:
+            shutil.rmtree(path, ignore_errors=True)
+            deleted.append(session)
+    if deleted:
+        with _loaded_lock:
+            for run_id in [run_id for (run_id, run) in _loaded.items()
+                           if os.path.basename(os.path.dirname(run.path)) in deleted]:
+                del _loaded[run_id]
+    return deleted
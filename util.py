@@ -144,27 +144,29 @@ def healthcare(facility_rate: float) -> str:
     elif facility_rate >= 2: return "Moderate"
     else: return "Low"
 
-def impute_column(column: pd.Series) -> pd.Series:
+def impute_value(column: pd.Series):
     """
-    Impute missing data in a column. Median for numerical features, mode for categorical.
+    Value imputed for missing data in a column (see impute_column). None if missing data is kept.
     """
     missing_data = column.isna().sum()
 
     if missing_data / len(column) < 0.3: # 0.03
         # Impute numerical column with median
         if np.issubdtype(column.dtype, np.number):
-            column = column.fillna(column.median())
+            return column.median()
         # Impute categorical column with mode
         else: # column.dtype == 'object'
-            column = column.fillna(column.mode()[0])
-        
+            return column.mode()[0]
+
     # TO DO: Impute columns with more than X% missing data using KNN?
-    else:
-        if np.issubdtype(column.dtype, np.number):
-            pass
-        else: # column.dtype == 'object'
-            pass
-    return column
+    return None
+
+def impute_column(column: pd.Series) -> pd.Series:
+    """
+    Impute missing data in a column. Median for numerical features, mode for categorical.
+    """
+    value = impute_value(column)
+    return column if value is None else column.fillna(value)
 
 def impute_df(df: pd.DataFrame) -> pd.DataFrame:
     """